@@ -1,6 +1,6 @@
 import datetime
 from abc import ABC
-from typing import Set
+from typing import Set, Tuple
 
 from covid19br.common.city_name_helpers import fix_city_name
 from covid19br.common.constants import NOT_INFORMED_CODE, PlaceType, State
@@ -142,6 +142,25 @@ class StateTotalBulletinModel(BulletinModel):
         if self.confirmed_cases < 0:
             self.confirmed_cases = NOT_INFORMED_CODE
 
+    def adjust(self, confirmed_cases_delta: int = 0, deaths_delta: int = 0):
+        """
+        Applies the (positive or negative) variation of both values at once,
+        following the same rules of the increase_* and decrease_* methods.
+        """
+        if confirmed_cases_delta:
+            self.confirmed_cases = self._apply_delta(
+                self.confirmed_cases, confirmed_cases_delta
+            )
+        if deaths_delta:
+            self.deaths = self._apply_delta(self.deaths, deaths_delta)
+
+    @staticmethod
+    def _apply_delta(value: int, delta: int) -> int:
+        if value == NOT_INFORMED_CODE:
+            return delta if delta > 0 else NOT_INFORMED_CODE
+        value += delta
+        return value if value >= 0 else NOT_INFORMED_CODE
+
     def to_csv_row(self):
         cases = self.confirmed_cases if self.confirmed_cases != NOT_INFORMED_CODE else 0
         deaths = self.deaths if self.deaths != NOT_INFORMED_CODE else 0
@@ -197,7 +216,15 @@ class CountyBulletinModel(BulletinModel):
         Overrides the default implementation to faster lookup for
         CountyBulletins for the same city in the same date.
         """
-        return hash((self.state, self.city, self.date))
+        return hash(self.key)
+
+    @property
+    def key(self) -> Tuple[str, str, datetime.date]:
+        """
+        Identifies the bulletin of a city in a given date. Can be used
+        directly as a dict key, without going through __hash__.
+        """
+        return self.city, self.state.value, self.date
 
     def to_csv_row(self):
         cases = self.confirmed_cases if self.confirmed_cases != NOT_INFORMED_CODE else 0
@@ -205,7 +232,7 @@ class CountyBulletinModel(BulletinModel):
         return {"municipio": self.city, "confirmados": cases, "mortes": deaths}
 
     def merge_data(self, other):
-        if isinstance(other, self.__class__) and hash(self) == hash(other):
+        if isinstance(other, self.__class__) and self.key == other.key:
             if not self.has_deaths and other.has_deaths:
                 self.deaths = other.deaths
                 self.sources.update(other.sources)
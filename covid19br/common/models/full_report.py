@@ -1,5 +1,9 @@
 import datetime
-from typing import Dict, List, Optional, Set
+import heapq
+from bisect import insort
+from functools import cached_property
+from operator import attrgetter
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple, Union
 
 from covid19br.common.constants import State, ReportQuality
 from covid19br.common.demographic_utils import DemographicUtils
@@ -31,10 +35,13 @@ class FullReportModel:
 
     # we can fact check with lots of different sources
     _official_total_bulletins: List[StateTotalBulletinModel]
-    _county_bulletins: Dict[int, CountyBulletinModel]
+    _county_bulletins: Dict[Tuple, CountyBulletinModel]
+    _sorted_county_keys: List[Tuple]
     _auto_calculated_total: StateTotalBulletinModel
-    _expected_qualities: List
-    _warnings: Set[BulletinWarning]
+    _expected_qualities: FrozenSet[ReportQuality]
+    _warnings: Dict[str, BulletinWarning]
+    _warnings_slug_cache: Optional[str]
+    _auto_detect_done: bool
     _notes: Set[str]
 
     def __init__(self, reference_date, published_at, state, qualities):
@@ -45,10 +52,12 @@ class FullReportModel:
         self.published_at = published_at
         self.state = state
         self._county_bulletins = {}
-        self._warnings = set()
+        self._sorted_county_keys = []
+        self._warnings = {}
+        self._warnings_slug_cache = None
+        self._auto_detect_done = False
         self._notes = set()
-        self._expected_qualities = qualities
-        self.undefined_or_imported_cases_bulletin = None
+        self._expected_qualities = frozenset(qualities)
         self._official_total_bulletins = []
         self._auto_calculated_total = StateTotalBulletinModel(
             date=reference_date, state=state, source="Soma automática"
@@ -58,19 +67,21 @@ class FullReportModel:
         )
 
     def __repr__(self):
+        has_undefined_or_imported_cases = self.has_undefined_or_imported_cases
+        total_bulletin = self.total_bulletin
         return (
             f"FullReportModel("
             f"state={self.state.value}, "
             f"reference_date={self.reference_date.strftime('%d/%m/%Y')}, "
             f"published_at={self.published_at.strftime('%d/%m/%Y')}, "
             f"qtd_county_bulletins={len(self._county_bulletins)}, "
-            f"has_undefined_or_imported_cases={self.has_undefined_or_imported_cases}, "
-            f"total_deaths={self.total_bulletin.deaths}, "
-            f"total_confirmed_cases={self.total_bulletin.confirmed_cases}"
+            f"has_undefined_or_imported_cases={has_undefined_or_imported_cases}, "
+            f"total_deaths={total_bulletin.deaths}, "
+            f"total_confirmed_cases={total_bulletin.confirmed_cases}"
             f")"
         )
 
-    @property
+    @cached_property
     def total_bulletin(self) -> StateTotalBulletinModel:
         if self._official_total_bulletins:
             for official_bulletin in self._official_total_bulletins:
@@ -78,23 +89,31 @@ class FullReportModel:
                     return official_bulletin
         return self._auto_calculated_total
 
-    @property
+    @cached_property
     def county_bulletins(self) -> List[CountyBulletinModel]:
-        county_bulletins = self._county_bulletins.values()
+        """
+        All the county bulletins of the state (with the missing cities zeroed), ordered by city.
+        """
+        county_bulletins = [
+            self._county_bulletins[key] for key in self._sorted_county_keys
+        ]
         bulletins_qt = len(county_bulletins)
         expected_bulletins_qt = self.demographics.get_cities_amount(self.state)
         if bulletins_qt == expected_bulletins_qt:
-            return list(county_bulletins)
+            return county_bulletins
         missing_bulletins = self._get_missing_bulletins()
+        missing_bulletins.sort(key=attrgetter("city"))
         if ReportQuality.ONLY_TOTAL not in self._expected_qualities:
             for bulletin in missing_bulletins:
                 self.add_note(
                     f"A cidade {bulletin.city} não foi encontrada pelo raspador, "
                     f"então foi dado que o valor de óbitos e casos para ela é zero."
                 )
-        return [*self._county_bulletins.values(), *missing_bulletins]
+        return list(
+            heapq.merge(county_bulletins, missing_bulletins, key=attrgetter("city"))
+        )
 
-    @property
+    @cached_property
     def has_undefined_or_imported_cases(self):
         return (
             bool(self.undefined_or_imported_cases_bulletin)
@@ -102,59 +121,111 @@ class FullReportModel:
         )
 
     def add_new_bulletin(self, bulletin: BulletinModel):
-        if isinstance(bulletin, CountyBulletinModel):
-            bulletin_key = hash(bulletin)
-            existent_bulletin = self._pop_county_bulletin(bulletin_key)
-            if existent_bulletin:
-                bulletin = self._compare_county_bulletins_and_return_the_completest(
-                    existent_bulletin, bulletin
-                )
-            self._county_bulletins[bulletin_key] = bulletin
-        elif isinstance(bulletin, ImportedUndefinedBulletinModel):
-            self.undefined_or_imported_cases_bulletin = bulletin
-        elif isinstance(bulletin, StateTotalBulletinModel):
-            if not bulletin.is_empty:
-                self._official_total_bulletins.append(bulletin)
-            return
+        handler = self._BULLETIN_HANDLERS.get(type(bulletin))
+        if handler is None:
+            # subclasses of the known models don't match the exact type lookup
+            handler = next(
+                (
+                    bulletin_handler
+                    for bulletin_class, bulletin_handler in self._BULLETIN_HANDLERS.items()
+                    if isinstance(bulletin, bulletin_class)
+                ),
+                None,
+            )
+            if handler is None:
+                return
+        self._auto_detect_done = False
+        handler(self, bulletin)
+
+    def _add_county_bulletin(self, bulletin: CountyBulletinModel):
+        bulletin_key = bulletin.key
+        confirmed_cases_delta = deaths_delta = 0
+        existent_bulletin = self._county_bulletins.get(bulletin_key)
+        if existent_bulletin:
+            # the existent bulletin may be updated by the merge, so its values
+            # have to be discounted before the comparison
+            if existent_bulletin.has_confirmed_cases:
+                confirmed_cases_delta -= existent_bulletin.confirmed_cases
+            if existent_bulletin.has_deaths:
+                deaths_delta -= existent_bulletin.deaths
+            bulletin = self._compare_county_bulletins_and_return_the_completest(
+                existent_bulletin, bulletin
+            )
         else:
-            return
-
+            # the key starts with the city name, so this keeps the bulletins ordered by city
+            insort(self._sorted_county_keys, bulletin_key)
+        self._county_bulletins[bulletin_key] = bulletin
+        self.__dict__.pop("county_bulletins", None)
         if bulletin.has_confirmed_cases:
-            self._auto_calculated_total.increase_confirmed_cases(
-                bulletin.confirmed_cases
-            )
+            confirmed_cases_delta += bulletin.confirmed_cases
+        if bulletin.has_deaths:
+            deaths_delta += bulletin.deaths
+        self._auto_calculated_total.adjust(confirmed_cases_delta, deaths_delta)
+
+    def _add_undefined_or_imported_bulletin(
+        self, bulletin: ImportedUndefinedBulletinModel
+    ):
+        self.undefined_or_imported_cases_bulletin = bulletin
+        self.__dict__.pop("has_undefined_or_imported_cases", None)
+        auto_calculated_total = self._auto_calculated_total
+        if bulletin.has_confirmed_cases:
+            auto_calculated_total.increase_confirmed_cases(bulletin.confirmed_cases)
         if bulletin.has_deaths:
-            self._auto_calculated_total.increase_deaths(bulletin.deaths)
+            auto_calculated_total.increase_deaths(bulletin.deaths)
+
+    def _add_official_total_bulletin(self, bulletin: StateTotalBulletinModel):
+        if not bulletin.is_empty:
+            self._official_total_bulletins.append(bulletin)
+            self.__dict__.pop("total_bulletin", None)
+
+    _BULLETIN_HANDLERS = {
+        CountyBulletinModel: _add_county_bulletin,
+        ImportedUndefinedBulletinModel: _add_undefined_or_imported_bulletin,
+        StateTotalBulletinModel: _add_official_total_bulletin,
+    }
+
+    def invalidate(self):
+        """
+        Discards everything that was computed from the report data (cached totals and
+        the automatic detection of warnings), so it is computed again on the next access.
+        Use it if the report data is changed without going through add_new_bulletin.
+        """
+        self._auto_detect_done = False
+        for attr in (
+            "total_bulletin",
+            "county_bulletins",
+            "has_undefined_or_imported_cases",
+        ):
+            self.__dict__.pop(attr, None)
 
     def check_total_death_cases(self) -> bool:
-        if not self._official_total_bulletins:
+        official_total_bulletins = self._official_total_bulletins
+        if not official_total_bulletins:
             return False
         auto_calculated_deaths = self._auto_calculated_total.deaths
         return all(
-            [
-                auto_calculated_deaths == official_bulletin.deaths
-                for official_bulletin in self._official_total_bulletins
-            ]
+            auto_calculated_deaths == official_bulletin.deaths
+            for official_bulletin in official_total_bulletins
         )
 
     def check_total_confirmed_cases(self) -> bool:
-        if not self._official_total_bulletins:
+        official_total_bulletins = self._official_total_bulletins
+        if not official_total_bulletins:
             return False
         auto_calculated_cases = self._auto_calculated_total.confirmed_cases
         return all(
-            [
-                auto_calculated_cases == official_bulletin.confirmed_cases
-                for official_bulletin in self._official_total_bulletins
-            ]
+            auto_calculated_cases == official_bulletin.confirmed_cases
+            for official_bulletin in official_total_bulletins
         )
 
+    def iter_csv_rows(self):
+        for bulletin in self.county_bulletins:
+            yield bulletin.to_csv_row()
+        yield self.undefined_or_imported_cases_bulletin.to_csv_row()
+        yield self.total_bulletin.to_csv_row()
+
     def to_csv_rows(self):
-        rows = []
-        for bulletin in sorted(self.county_bulletins, key=lambda x: x.city):
-            rows.append(bulletin.to_csv_row())
-        rows.append(self.undefined_or_imported_cases_bulletin.to_csv_row())
-        rows.append(self.total_bulletin.to_csv_row())
-        return rows
+        return list(self.iter_csv_rows())
 
     def export_metadata_in_csv(self):
         total_bulletin = self.total_bulletin
@@ -184,7 +255,7 @@ class FullReportModel:
 
         if self._warnings:
             resp.append("\nWARNINGS:")
-            for warning in self._warnings:
+            for warning in self._warnings.values():
                 description = "\n\t".join(warning.description.split("\n"))
                 resp.append(f"- {warning.slug}:\n\t{description}")
 
@@ -201,23 +272,33 @@ class FullReportModel:
         """
         self._notes.add(note)
 
-    def add_warning(self, slug: WarningType, description: str = None):
+    def add_warning(
+        self, slug: WarningType, description: Union[str, Callable[[], str]] = None
+    ):
         """
         It saves warnings of things that didn't go well during the report assembly (such as missing data,
         data without validation, etc.). Use with moderation because all warnings are concatenated and used
         in the name of the state's csv and if this name gets too long it can be more of a hindrance than a help.
         If the thing you want to inform is not critical, use the method add_note instead :)
+        Only the first warning of each slug is kept, so the description can be given as a callable
+        to avoid building it when the slug was already reported.
         """
-        warning = BulletinWarning(slug.value, description)
-        self._warnings.add(warning)
+        if slug.value in self._warnings:
+            return
+        if callable(description):
+            description = description()
+        self._warnings[slug.value] = BulletinWarning(slug.value, description)
+        self._warnings_slug_cache = None
 
     @property
     def warnings_slug(self) -> str:
         self._auto_detect_warnings()
-        if not self._warnings:
-            return ""
-        warnings = set([w.slug for w in self._warnings])
-        return "__" + "__".join(sorted(warnings))
+        if self._warnings_slug_cache is None:
+            if self._warnings:
+                self._warnings_slug_cache = "__" + "__".join(sorted(self._warnings))
+            else:
+                self._warnings_slug_cache = ""
+        return self._warnings_slug_cache
 
     @property
     def sources(self) -> str:
@@ -238,13 +319,13 @@ class FullReportModel:
 
     def _get_missing_bulletins(self) -> List[CountyBulletinModel]:
         all_cities = self.demographics.get_cities(self.state)
-        existent_cities = [
+        existent_cities = {
             bulletin.city for bulletin in self._county_bulletins.values()
-        ]
+        }
         resp = []
         for city in all_cities:
             city_name = city.city
-            if city.city not in existent_cities:
+            if city_name not in existent_cities:
                 resp.append(
                     CountyBulletinModel(
                         date=self.published_at,
@@ -255,17 +336,6 @@ class FullReportModel:
                 )
         return resp
 
-    def _pop_county_bulletin(self, bulletin_key: int) -> Optional[CountyBulletinModel]:
-        existent_bulletin = self._county_bulletins.pop(bulletin_key, None)
-        if existent_bulletin:
-            if existent_bulletin.has_confirmed_cases:
-                self._auto_calculated_total.decrease_confirmed_cases(
-                    existent_bulletin.confirmed_cases
-                )
-            if existent_bulletin.has_deaths:
-                self._auto_calculated_total.decrease_deaths(existent_bulletin.deaths)
-        return existent_bulletin
-
     def _compare_county_bulletins_and_return_the_completest(
         self, existent_bulletin: CountyBulletinModel, new_bulletin: CountyBulletinModel
     ) -> CountyBulletinModel:
@@ -276,38 +346,69 @@ class FullReportModel:
         Returns the bulletin with more information or, if both the bulletins have incomplete data,
         returns a merged bulletin to get a completer one.
         """
-        both_have_deaths = existent_bulletin.has_deaths and new_bulletin.has_deaths
-        both_have_confirmed_cases = (
-            existent_bulletin.has_confirmed_cases and new_bulletin.has_confirmed_cases
-        )
-        if existent_bulletin == new_bulletin:
-            return existent_bulletin
+        existent_has_deaths = existent_bulletin.has_deaths
+        existent_has_confirmed_cases = existent_bulletin.has_confirmed_cases
+        new_has_deaths = new_bulletin.has_deaths
+        new_has_confirmed_cases = new_bulletin.has_confirmed_cases
 
-        if (both_have_deaths and existent_bulletin.deaths != new_bulletin.deaths) or (
-            both_have_confirmed_cases
+        # the divergence check must come before the completeness ones, otherwise
+        # complete bulletins with different values would never be reported
+        if (
+            existent_has_deaths
+            and new_has_deaths
+            and existent_bulletin.deaths != new_bulletin.deaths
+        ) or (
+            existent_has_confirmed_cases
+            and new_has_confirmed_cases
             and existent_bulletin.confirmed_cases != new_bulletin.confirmed_cases
         ):
             self.add_warning(
                 WarningType.SOURCES_DONT_MATCH,
-                description=(
+                description=lambda: (
                     "Valor de casos/óbitos dos municípios inconsistente entre as duas fontes de dados.\n"
                     f"Fonte 1: {existent_bulletin.sources}\n"
                     f"Fonte 2: {new_bulletin.sources}"
                 ),
             )
 
-        if existent_bulletin.is_complete:
+        if existent_has_deaths and existent_has_confirmed_cases:
             return existent_bulletin
-        if new_bulletin.is_complete:
+        if new_has_deaths and new_has_confirmed_cases:
             return new_bulletin
         existent_bulletin.merge_data(new_bulletin)
         return existent_bulletin
 
+    def _totals_match(self) -> Tuple[bool, bool]:
+        """
+        Same as check_total_confirmed_cases and check_total_death_cases, but checking
+        both values in a single pass over the official bulletins.
+        Returns a (confirmed_cases_match, deaths_match) tuple.
+        """
+        official_total_bulletins = self._official_total_bulletins
+        if not official_total_bulletins:
+            return False, False
+        auto_calculated_cases = self._auto_calculated_total.confirmed_cases
+        auto_calculated_deaths = self._auto_calculated_total.deaths
+        cases_match = deaths_match = True
+        for official_bulletin in official_total_bulletins:
+            if (
+                cases_match
+                and auto_calculated_cases != official_bulletin.confirmed_cases
+            ):
+                cases_match = False
+            if deaths_match and auto_calculated_deaths != official_bulletin.deaths:
+                deaths_match = False
+            if not cases_match and not deaths_match:
+                break
+        return cases_match, deaths_match
+
     def _auto_detect_warnings(self):
-        if (
-            ReportQuality.COUNTY_BULLETINS in self._expected_qualities
-            and not self._county_bulletins
-        ):
+        if self._auto_detect_done:
+            return
+        qualities = self._expected_qualities
+        total_bulletin = self.total_bulletin
+        has_undefined_or_imported_cases = self.has_undefined_or_imported_cases
+        if ReportQuality.COUNTY_BULLETINS in qualities and not self._county_bulletins:
             self.add_warning(
                 WarningType.MISSING_COUNTY_BULLETINS,
                 description=(
@@ -316,8 +417,8 @@ class FullReportModel:
                 ),
             )
         if (
-            ReportQuality.UNDEFINED_OR_IMPORTED_CASES in self._expected_qualities
-            and not self.has_undefined_or_imported_cases
+            ReportQuality.UNDEFINED_OR_IMPORTED_CASES in qualities
+            and not has_undefined_or_imported_cases
         ):
             self.add_warning(
                 WarningType.MISSING_IMPORTED_UNDEFINED_CASES,
@@ -326,12 +427,12 @@ class FullReportModel:
                     "porém algo deu errado e não foi possível encontrar os dados."
                 ),
             )
-        if ReportQuality.ONLY_TOTAL in self._expected_qualities:
+        if ReportQuality.ONLY_TOTAL in qualities:
             self.add_warning(
                 WarningType.ONLY_TOTAL,
                 description="Apenas a raspagem do total foi implementada por enquanto.",
             )
-        if not self.total_bulletin.has_confirmed_cases:
+        if not total_bulletin.has_confirmed_cases:
             self.add_warning(
                 WarningType.MISSING_CONFIRMED_CASES,
                 description=(
@@ -340,7 +441,7 @@ class FullReportModel:
                     "deve ser atualizado."
                 ),
             )
-        if not self.total_bulletin.has_deaths:
+        if not total_bulletin.has_deaths:
             self.add_warning(
                 WarningType.MISSING_DEATHS,
                 description=(
@@ -357,24 +458,26 @@ class FullReportModel:
                     "são apenas a soma automática dos dados dos municípios."
                 ),
             )
-        elif not self._auto_calculated_total.is_empty and (
-            not self.check_total_confirmed_cases() or not self.check_total_death_cases()
-        ):
-            sources_data = "\n".join(
-                [
-                    f"Fonte {{ {' | '.join(bulletin.sources)} }}: "
-                    f"{bulletin.confirmed_cases} confirmados e {bulletin.deaths} óbitos."
-                    for bulletin in self._official_total_bulletins
-                ]
-            )
+        elif not self._auto_calculated_total.is_empty and not all(self._totals_match()):
             self.add_warning(
                 WarningType.TOTAL_DONT_MATCH,
-                description=(
-                    "A soma automática do total de casos e mortes por municípios não bate com o total "
-                    "disponibilizado por fontes oficiais.\n"
-                    f"Fonte soma automática: "
-                    f"{self._auto_calculated_total.confirmed_cases} confirmados "
-                    f"e {self._auto_calculated_total.deaths} óbitos.\n"
-                    f"{sources_data}"
-                ),
+                description=self._describe_totals_mismatch,
             )
+        self._auto_detect_done = True
+
+    def _describe_totals_mismatch(self) -> str:
+        sources_data = "\n".join(
+            [
+                f"Fonte {{ {' | '.join(bulletin.sources)} }}: "
+                f"{bulletin.confirmed_cases} confirmados e {bulletin.deaths} óbitos."
+                for bulletin in self._official_total_bulletins
+            ]
+        )
+        return (
+            "A soma automática do total de casos e mortes por municípios não bate com o total "
+            "disponibilizado por fontes oficiais.\n"
+            f"Fonte soma automática: "
+            f"{self._auto_calculated_total.confirmed_cases} confirmados "
+            f"e {self._auto_calculated_total.deaths} óbitos.\n"
+            f"{sources_data}"
+        )
@@ -1,7 +1,13 @@
-from collections import namedtuple
+from dataclasses import dataclass, field
 from enum import Enum
 
-BulletinWarning = namedtuple("BulletinWarning", "slug description")
+
+@dataclass(frozen=True)
+class BulletinWarning:
+    slug: str
+    # only the slug identifies a warning, so the (long) description is left
+    # out of the comparisons and of the hash
+    description: str = field(compare=False)
 
 
 class WarningType(Enum):
@@ -90,7 +90,7 @@ def save_results_in_csv(results, filename_pattern):
             if not filename.parent.exists():
                 filename.parent.mkdir(parents=True)
             print(f"({report.reference_date}) Formatting and saving file {filename}...")
-            save_csv(filename, report.to_csv_rows())
+            save_csv(filename, report.iter_csv_rows())
 
 
 def save_metadata(results):